@@ -13,16 +13,27 @@
 # ---
 
 # +
+# Ativando a aceleração da Intel (oneDAL) para KMeans e PCA, se disponível
+try:
+    from sklearnex import patch_sklearn
+    patch_sklearn()
+except ImportError:
+    pass
+
+import numpy as np
 import pandas as pd
 import os
+import matplotlib
+
+# Backend sem GUI: o Streamlit só precisa da renderização em memória
+matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
 import seaborn as sns
 import streamlit as st
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.compose import ColumnTransformer
+from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline
 from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
 import joblib
 from mpl_toolkits.mplot3d import Axes3D
 
@@ -39,56 +50,225 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # Configurações iniciais
-os.environ["OMP_NUM_THREADS"] = "1"
 DADOS = "dados/Mall_Customers_no_CustomerID.csv"
+COLUNAS_NUMERICAS = ["Age", "Annual Income (k$)", "Spending Score (1-100)"]
+CLUSTERIZADO = "dados/clustered.feather"
+MODELO = "modelos/pipeline_preprocessing_pca_clustering.pkl"
 RANDOM_STATE = 42
 
-# Carregando os dados
-df = pd.read_csv(DADOS)
+# Paletas resolvidas uma única vez no carregamento do módulo
+PALETAS_SET2 = {n: sns.color_palette("Set2", n) for n in (2, 5)}
+PALETA_TAB10 = sns.color_palette("tab10", 5)
 
-# Pré-processamento
-preprocessing = ColumnTransformer(
-    [
-        ("standard", StandardScaler(), ["Age", "Annual Income (k$)", "Spending Score (1-100)"]),
-        ("onehot", OneHotEncoder(), ["Gender"])
-    ]
-)
+# Carregando os dados (cacheado entre reruns do Streamlit)
+@st.cache_data
+def carregar_dados(caminho):
+    # O engine pyarrow tokeniza o CSV com SIMD e em múltiplas threads, e os
+    # dtypes explícitos dispensam a passada de inferência de tipos
+    df = pd.read_csv(
+        caminho,
+        engine="pyarrow",
+        dtype={
+            "Age": "int32",
+            "Annual Income (k$)": "int32",
+            "Spending Score (1-100)": "int32",
+            "Gender": "category",
+        },
+    )
+    # float32 basta para estes dados e corta pela metade a banda de memória
+    # na padronização, no PCA e nas distâncias do KMeans
+    for col in COLUNAS_NUMERICAS:
+        df[col] = df[col].astype(np.float32)
+    return df
 
-# Pipeline de PCA e clustering
-pipeline = Pipeline(
-    [
-        ("preprocessing", preprocessing),
-        ("pca", PCA(n_components=3, random_state=RANDOM_STATE)),
-        ("clustering", KMeans(n_clusters=5, random_state=RANDOM_STATE, n_init=10))
-    ]
-)
+# Pré-processamento manual: padroniza as colunas numéricas e binariza
+# "Gender" direto em NumPy, sem o overhead de despacho do ColumnTransformer,
+# entregando um único array float32 contíguo para o PCA
+class PreprocessadorManual(TransformerMixin, BaseEstimator):
+    def fit(self, X, y=None):
+        num = X[COLUNAS_NUMERICAS].to_numpy(np.float32)
+        self.mean_ = num.mean(axis=0)
+        self.scale_ = num.std(axis=0)
+        return self
+
+    def transform(self, X):
+        num = (X[COLUNAS_NUMERICAS].to_numpy(np.float32) - self.mean_) / self.scale_
+        genero = (X["Gender"].to_numpy() == "Male").astype(np.float32)[:, None]
+        return np.concatenate([num, genero], axis=1)
+
+# PCA via matriz de Gram: um único GEMM (X.T @ X) seguido de eigh simétrico,
+# muito mais barato que a SVD completa quando há poucas features
+class CovPCA(TransformerMixin, BaseEstimator):
+    def __init__(self, n_components=3):
+        self.n_components = n_components
+
+    def fit(self, X, y=None):
+        X = np.asarray(X)
+        self.mean_ = X.mean(axis=0)
+        Xc = X - self.mean_
+        gram = Xc.T @ Xc
+        autovalores, autovetores = np.linalg.eigh(gram)
+        ordem = np.argsort(autovalores)[::-1][:self.n_components]
+        self.components_ = autovetores[:, ordem].T
+        return self
+
+    def transform(self, X):
+        return (np.asarray(X) - self.mean_) @ self.components_.T
+
+# Renumera os clusters após o fit para a numeração usada nas tabelas de
+# conclusão: a nova codificação do Gender permuta os rótulos que o KMeans
+# atribui, ainda que a partição seja a mesma. A chave é o perfil médio de cada
+# cluster nos dados originais — score baixo = 2; scores altos = 3 (renda
+# baixa) e 4 (renda alta); moderados = 0 (mais velho) e 1 (mais jovem)
+def renumerar_clusters(kmeans, df):
+    medias = df.groupby(kmeans.labels_)[COLUNAS_NUMERICAS].mean()
+    idade, renda, score = (medias[c] for c in COLUNAS_NUMERICAS)
+    por_score = score.sort_values().index
+    mapa = np.empty(kmeans.n_clusters, np.int64)
+    mapa[por_score[0]] = 2
+    moderados = sorted(por_score[1:3], key=idade.get, reverse=True)
+    mapa[moderados[0]], mapa[moderados[1]] = 0, 1
+    altos = sorted(por_score[3:5], key=renda.get)
+    mapa[altos[0]], mapa[altos[1]] = 3, 4
+    kmeans.cluster_centers_ = kmeans.cluster_centers_[np.argsort(mapa)]
+    kmeans.labels_ = mapa[kmeans.labels_]
+
+# Montando e treinando o pipeline uma única vez por processo
+@st.cache_resource
+def construir_pipeline(df):
+    pipeline = Pipeline(
+        [
+            ("preprocessing", PreprocessadorManual()),
+            ("pca", CovPCA(n_components=3)),
+            ("clustering", KMeans(n_clusters=5, random_state=RANDOM_STATE, n_init=10, algorithm="elkan"))
+        ]
+    )
 
-pipeline.fit(df)
-df_clustered = df.copy()
-df_clustered["cluster"] = pipeline["clustering"].labels_
+    pipeline.fit(df)
+    renumerar_clusters(pipeline["clustering"], df)
+
+    # Salvando o modelo a cada fit real (uma vez por processo, graças ao
+    # st.cache_resource), para que o artefato em disco nunca fique defasado
+    # em relação ao código; compress=3 reduz o arquivo mais ou menos pela metade
+    os.makedirs(os.path.dirname(MODELO), exist_ok=True)
+    joblib.dump(pipeline, MODELO, compress=3)
+
+    # O feather de clusters é reescrito junto com cada fit, para que o arquivo
+    # nunca carregue rótulos de um modelo antigo; assign dispensa a cópia
+    # prévia do frame e o dtype categórico barateia os groupby dos boxplots
+    df.assign(
+        cluster=pd.Categorical.from_codes(pipeline["clustering"].labels_, categories=range(5))
+    ).to_feather(CLUSTERIZADO)
+
+    return pipeline
+
+# Matriz pré-processada e projetada pelo PCA, materializada uma única vez
+# como ndarray e compartilhada por todas as visualizações
+@st.cache_data
+def matriz_preprocessada(_pipeline, df):
+    return _pipeline[:-1].transform(df)
+
+# Projeção PCA dos dados (o sub-pipeline já está ajustado, basta transformar)
+@st.cache_data
+def projecao_pca(_pipeline, df):
+    return pd.DataFrame(
+        matriz_preprocessada(_pipeline, df),
+        columns=[f'pca{i}' for i in range(3)]
+    )
+
+# Projeção rotulada + centroides, compartilhadas pelas duas visões 3D
+@st.cache_data
+def projecao_e_centroides(_pipeline, df):
+    df_pca = projecao_pca(_pipeline, df)
+    df_pca["cluster"] = _pipeline["clustering"].labels_
+    return df_pca, _pipeline["clustering"].cluster_centers_
+
+# Dados com o rótulo de cluster, persistidos em feather por construir_pipeline
+@st.cache_data
+def carregar_clusterizado(caminho):
+    return pd.read_feather(caminho)
+
+# Figuras estáticas cacheadas — seaborn não precisa redesenhar a cada rerun
+@st.cache_resource
+def figura_pairplot(df_clustered):
+    fig = sns.pairplot(df_clustered, diag_kind="kde", hue="cluster", palette=PALETA_TAB10).fig
+    # Tira a figura do registro global do pyplot; o cache mantém a referência
+    plt.close(fig)
+    return fig
+
+@st.cache_resource
+def figura_boxplots(df_clustered, hue, n_colors):
+    fig, axs = plt.subplots(nrows=1, ncols=3, figsize=(16, 5), tight_layout=True)
+    palette = PALETAS_SET2[n_colors]
+    for ax, col in zip(axs, COLUNAS_NUMERICAS):
+        colunas_plot = ["cluster", col] + ([hue] if hue not in ("cluster", col) else [])
+        sns.boxplot(data=df_clustered[colunas_plot], x="cluster", y=col, hue=hue, ax=ax, palette=palette)
+    plt.close(fig)
+    return fig
 
-# Salvando o modelo
-joblib.dump(pipeline, "modelos/pipeline_preprocessing_pca_clustering.pkl")
+df = carregar_dados(DADOS)
+pipeline = construir_pipeline(df)
+df_clustered = carregar_clusterizado(CLUSTERIZADO)
+
+# Agrupamento dos índices por cluster em uma única passada (ordenação por balde)
+def _bucket_indices(labels, k):
+    counts = np.zeros(k, np.int64)
+    for l in labels:
+        counts[l] += 1
+    offsets = np.zeros(k + 1, np.int64)
+    offsets[1:] = np.cumsum(counts)
+    out = np.empty(labels.size, np.int64)
+    cursor = offsets[:-1].copy()
+    for i, l in enumerate(labels):
+        out[cursor[l]] = i
+        cursor[l] += 1
+    return offsets, out
+
+def _bucket_indices_numpy(labels, k):
+    offsets = np.zeros(k + 1, np.int64)
+    offsets[1:] = np.cumsum(np.bincount(labels, minlength=k))
+    return offsets, np.argsort(labels, kind="stable")
+
+_bucket_indices_impl = None
+
+def indices_por_cluster(labels, k):
+    # Compila o kernel com Numba na primeira chamada (import preguiçoso para
+    # não pesar o startup do Streamlit); sem Numba, usa o fallback NumPy
+    global _bucket_indices_impl
+    if _bucket_indices_impl is None:
+        try:
+            from numba import njit
+            _bucket_indices_impl = njit(cache=True)(_bucket_indices)
+        except ImportError:
+            _bucket_indices_impl = _bucket_indices_numpy
+    return _bucket_indices_impl(np.asarray(labels, np.int64), k)
 
 # Função para visualização de clusters
-def visualizar_cluster(dataframe, colunas, quantidade_cores, centroids=None, mostrar_pontos=False, coluna_clusters=None):
+def visualizar_cluster(dataframe, colunas, quantidade_cores, centroids=None, coluna_clusters=None):
     if coluna_clusters not in dataframe.columns:
         st.error(f"Coluna '{coluna_clusters}' não encontrada no dataframe.")
         return
 
     fig = plt.figure(figsize=(10, 7))
     ax = fig.add_subplot(111, projection='3d')
-    colors = sns.color_palette("Set2", quantidade_cores)
+    colors = PALETAS_SET2.get(quantidade_cores) or sns.color_palette("Set2", quantidade_cores)
+    # Fatias contíguas por cluster pré-computadas em uma única passada,
+    # em vez de um filtro booleano + cópia do dataframe por cluster
+    x = dataframe[colunas[0]].to_numpy()
+    y = dataframe[colunas[1]].to_numpy()
+    z = dataframe[colunas[2]].to_numpy()
+    offsets, ordem = indices_por_cluster(dataframe[coluna_clusters], quantidade_cores)
     for i in range(quantidade_cores):
-        pontos = dataframe[dataframe[coluna_clusters] == i] if mostrar_pontos else dataframe
-        ax.scatter(pontos[colunas[0]], pontos[colunas[1]], pontos[colunas[2]], color=colors[i], label=f'Cluster {i}')
+        idx = ordem[offsets[i]:offsets[i + 1]]
+        ax.scatter(x[idx], y[idx], z[idx], color=colors[i], label=f'Cluster {i}')
     if centroids is not None:
         ax.scatter(centroids[:, 0], centroids[:, 1], centroids[:, 2], marker='x', s=200, c='black')
     ax.set_xlabel(colunas[0])
     ax.set_ylabel(colunas[1])
     ax.set_zlabel(colunas[2])
-    plt.legend()
+    ax.legend()
     st.pyplot(fig)
+    plt.close(fig)
 
 # Iniciando a aplicação Streamlit
 st.title("Análise de Cluster de Clientes")
@@ -104,71 +284,48 @@ opcao_visualizacao = st.sidebar.selectbox(
 if opcao_visualizacao == "Pairplot":
     st.write("### Pairplot dos Clusters")
     st.write("Este gráfico mostra a distribuição dos clusters com base nas variáveis originais.")
-    pairplot_fig = sns.pairplot(df_clustered, diag_kind="kde", hue="cluster", palette="tab10")
-    st.pyplot(pairplot_fig)
+    st.pyplot(figura_pairplot(df_clustered))
 
 elif opcao_visualizacao == "Boxplot por Cluster":
     st.write("### Boxplot por Cluster")
     st.write("Compare as distribuições das variáveis para cada cluster.")
-    fig, axs = plt.subplots(nrows=1, ncols=3, figsize=(16, 5), tight_layout=True)
-    palette = sns.color_palette("Set2", n_colors=5)
-    for ax, col in zip(axs, df_clustered.select_dtypes("number")):
-        sns.boxplot(data=df_clustered, x="cluster", y=col, hue="cluster", ax=ax, palette=palette)
-    st.pyplot(fig)
+    st.pyplot(figura_boxplots(df_clustered, hue="cluster", n_colors=5))
 
 elif opcao_visualizacao == "Boxplot por Gênero":
     st.write("### Boxplot por Gênero")
     st.write("Compare as distribuições das variáveis para cada gênero dentro dos clusters.")
-    fig, axs = plt.subplots(nrows=1, ncols=3, figsize=(16, 5), tight_layout=True)
-    palette = sns.color_palette("Set2", n_colors=2)
-    for ax, col in zip(axs, df_clustered.select_dtypes("number")):
-        sns.boxplot(data=df_clustered, x="cluster", y=col, hue="Gender", ax=ax, palette=palette)
-    st.pyplot(fig)
-
-elif opcao_visualizacao == "Cluster em 3D (sem dispersão)":
-    st.write("### Cluster em 3D (sem dispersão)")
-    st.write("Visualização dos clusters em 3D após aplicação do PCA.")
-    df_pca = pd.DataFrame(
-        pipeline[:-1].fit_transform(df),
-        columns=[f'pca{i}' for i in range(3)]
-    )
-    df_pca["cluster"] = pipeline["clustering"].labels_
-    visualizar_cluster(
-        dataframe=df_pca,
-        colunas=['pca0', 'pca1', 'pca2'],
-        quantidade_cores=5,
-        coluna_clusters="cluster"
-    )
+    st.pyplot(figura_boxplots(df_clustered, hue="Gender", n_colors=2))
 
-elif opcao_visualizacao == "Cluster em 3D (com dispersão)":
-    st.write("### Cluster em 3D (com dispersão)")
-    st.write("Visualização dos clusters em 3D com dispersão após aplicação do PCA.")
-    df_pca = pd.DataFrame(
-        pipeline[:-1].fit_transform(df),
-        columns=[f'pca{i}' for i in range(3)]
-    )
-    df_pca["cluster"] = pipeline["clustering"].labels_
-    centroids = pipeline["clustering"].cluster_centers_
+elif opcao_visualizacao in ("Cluster em 3D (sem dispersão)", "Cluster em 3D (com dispersão)"):
+    com_dispersao = opcao_visualizacao == "Cluster em 3D (com dispersão)"
+    st.write(f"### {opcao_visualizacao}")
+    if com_dispersao:
+        st.write("Visualização dos clusters em 3D com dispersão após aplicação do PCA.")
+    else:
+        st.write("Visualização dos clusters em 3D após aplicação do PCA.")
+    df_pca, centroids = projecao_e_centroides(pipeline, df)
     visualizar_cluster(
         dataframe=df_pca,
         colunas=['pca0', 'pca1', 'pca2'],
         quantidade_cores=5,
-        centroids=centroids,
-        mostrar_pontos=True,
+        centroids=centroids if com_dispersao else None,
         coluna_clusters="cluster"
     )
 
 # Conclusão do Projeto de Clusterização de Clientes
+# Texto estático montado uma única vez e emitido em um único st.markdown
+
+@st.cache_data
+def conclusao_md():
+    return """
+## Conclusão do Projeto de Clusterização de Clientes
 
-st.header("Conclusão do Projeto de Clusterização de Clientes")
+### Resumo dos Principais Aspectos e Resultados
 
-st.subheader("Resumo dos Principais Aspectos e Resultados")
-st.write("""
 Neste projeto, realizamos uma análise detalhada dos dados de clientes, aplicando técnicas de pré-processamento, visualização e clusterização. Utilizamos gráficos 2D e 3D para interpretar melhor a distribuição dos clusters e identificar padrões e correlações. Implementamos a redução de dimensionalidade com PCA para melhorar a qualidade dos clusters e facilitar a visualização.
-""")
 
-st.subheader("Descrição dos Clusters Antes do PCA")
-st.write("""
+### Descrição dos Clusters Antes do PCA
+
 | Pontuação de Gastos | Renda   | Idade    | Cluster |
 |---------------------|---------|----------|---------|
 | Alta                | Alta    | Jovem    | 0       |
@@ -176,10 +333,9 @@ st.write("""
 | Alta                | Baixa   | Jovem    | 2       |
 | Baixa               | Alta    | Moderada | 3       |
 | Moderada            | Moderada| Jovem    | 4       |
-""")
 
-st.subheader("Análise dos Resultados")
-st.write("""
+### Análise dos Resultados
+
 Após aplicar o PCA, identificamos os seguintes padrões nos clusters:
 
 | Cluster | Idade                      | Renda Anual | Score de Gastos         | Observações                                                                                   |
@@ -189,14 +345,15 @@ Após aplicar o PCA, identificamos os seguintes padrões nos clusters:
 | 2       | 35 a 50 anos               | Alta        | Menor                  | Clientes com alta renda anual, mas scores menores, indicando possível falta de crédito.      |
 | 0       | Acima de 50 até 60 anos    | Moderada    | Moderado               | Representam a maior parte dos clientes, com rendas anuais e scores muito semelhantes ao Cluster 1. |
 | 1       | Maior que 20 até 35 anos   | Moderada    | Moderado               | Representam a maior parte dos clientes, com rendas anuais e scores muito semelhantes ao Cluster 0. |
-""")
 
-st.subheader("Conclusão Final")
-st.write("""
+### Conclusão Final
+
 Através desta análise, conseguimos segmentar os clientes em grupos distintos, facilitando a compreensão dos diferentes perfis de consumidores. Essas informações são valiosas para estratégias de marketing, crédito e tomada de decisões empresariais. A utilização de técnicas avançadas como PCA e visualizações 3D permitiu uma análise mais precisa e detalhada dos dados, revelando padrões importantes que não seriam aparentes em uma análise superficial.
 
 O projeto demonstrou a importância do pré-processamento, da redução de dimensionalidade e da visualização avançada na análise de dados de clientes, proporcionando insights valiosos e acionáveis.
-""")
+"""
+
+st.markdown(conclusao_md())
 # -
 
 